@@ -14,10 +14,18 @@
 
 from contextlib import contextmanager
 import logging
-from redlock import Redlock
+import redis
+from redlock import Redlock, Lock
 import time
 from threading import Thread
 
+
+def spawn_thread(target, *args):
+    thread = Thread(target=target, args=args)
+    thread.start()
+    return thread
+
+
 class ExtendableRedlock(Redlock):
     extend_script = """
     if redis.call("get",KEYS[1]) == ARGV[1] then
@@ -26,11 +34,47 @@ class ExtendableRedlock(Redlock):
         return 0
     end"""
 
-    def __init__(self, connection_list, retry_count=None, retry_delay=None):
-        super(ExtendableRedlock, self).__init__(connection_list, retry_count, retry_delay)
+    def __init__(self, connection_list, retry_count=None, retry_delay=None, cluster=False,
+                 clock=time.time, sleep=time.sleep, spawn=spawn_thread):
+        self.cluster = cluster
+        self.servers = [self.connect(connection_info) for connection_info in connection_list]
+        self.quorum = (len(connection_list) // 2) + 1
+        self.retry_count = retry_count or self.default_retry_count
+        self.retry_delay = retry_delay or self.default_retry_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.spawn = spawn
         self.logger = logging.getLogger(__name__)
         self._autoextend_threads = {}
 
+    def connect(self, connection_info):
+        try:
+            if self.cluster:
+                return LazyRedisCluster(cluster_client_class(), connection_info)
+            else:
+                return connect_client(redis.StrictRedis, connection_info)
+        except Exception as e:
+            raise Warning(str(e))
+
+    def lock(self, resource, ttl):
+        retry = 0
+        val = self.get_unique_id()
+        drift = int(ttl * self.clock_drift_factor) + 2
+
+        while retry < self.retry_count:
+            start_time = int(self.clock() * 1000)
+            n = len([s for s in self.servers if self.lock_instance(s, resource, val, ttl)])
+            elapsed_time = int(self.clock() * 1000) - start_time
+            validity = int(ttl - elapsed_time - drift)
+            if validity > 0 and n >= self.quorum:
+                return Lock(validity, resource, val)
+            else:
+                for server in self.servers:
+                    self.unlock_instance(server, resource, val)
+                retry += 1
+                self.sleep(self.retry_delay)
+        return False
+
     def extend_instance(self, server, resource, key, new_ttl):
         try:
             return server.eval(self.extend_script, 1, resource, key, new_ttl)
@@ -41,8 +85,15 @@ class ExtendableRedlock(Redlock):
         return len(
             [s for s in self.servers if self.extend_instance(s, lock.resource, lock.key, new_ttl)]) >= self.quorum
 
+    def is_valid_instance(self, server, resource, key):
+        try:
+            return server.get(resource) == key
+        except:
+            return False
+
     def is_valid(self, lock):
-        return len([s for s in self.servers if s.get(lock.resource) == lock.key]) >= self.quorum
+        return len(
+            [s for s in self.servers if self.is_valid_instance(s, lock.resource, lock.key)]) >= self.quorum
 
     @contextmanager
     def autoextend(self, lock, every_ms, new_ttl):
@@ -65,22 +116,60 @@ class ExtendableRedlock(Redlock):
         self.logger.debug('[{resource}] Stopped autoextending'.format(resource=lock.resource))
 
 
-class AutoExtendableLockThread(Thread):
+class AutoExtendableLockThread(object):
     def __init__(self, redlock, lock, every_ms, new_ttl):
-        super(AutoExtendableLockThread, self).__init__()
         self.lock = lock
         self.redlock = redlock
         self.every_ms = every_ms
         self.new_ttl = new_ttl
         self.extend = True
+        self.thread = None
+
+    def start(self):
+        self.thread = self.redlock.spawn(self.run)
 
     def run(self):
         while self.extend:
             self.redlock.extend(self.lock, self.new_ttl)
-            time.sleep(float(self.every_ms) / 1000)
+            self.redlock.sleep(float(self.every_ms) / 1000)
 
     def stop(self):
         self.extend = False
 
+    def join(self):
+        self.thread.join()
+
+
+def connect_client(client_class, connection_info):
+    if isinstance(connection_info, dict):
+        return client_class(**connection_info)
+    else:
+        return client_class.from_url(connection_info)
+
+
+class LazyRedisCluster(object):
+    """
+        RedisCluster connects as soon as it is built: this defers it to the first command, so an
+        unreachable node fails its commands (and counts as down) instead of the whole redlock.
+    """
+    def __init__(self, client_class, connection_info):
+        self.client_class = client_class
+        self.connection_info = connection_info
+        self.client = None
+
+    def __getattr__(self, name):
+        if self.client is None:
+            self.client = connect_client(self.client_class, self.connection_info)
+        return getattr(self.client, name)
+
+
+def cluster_client_class():
+    try:
+        from redis.cluster import RedisCluster
+    except ImportError:
+        raise Warning("Redis Cluster support requires redis-py >= 4.1")
+    return RedisCluster
+
+
 class LockAutoextendAlreadyRunning(Exception):
     pass
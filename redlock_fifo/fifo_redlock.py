@@ -13,16 +13,17 @@
 # limitations under the License.
 
 import logging
-from time import sleep
+import time
 
-from redlock_fifo.extendable_redlock import ExtendableRedlock
+from redlock_fifo.extendable_redlock import ExtendableRedlock, spawn_thread
 
 
 class FIFORedlock(ExtendableRedlock):
     def __init__(self, connection_list, retry_count=1, retry_delay=0.2,
                  fifo_retry_count=30, fifo_retry_delay=0.2, fifo_queue_length=64,
-                 fifo_ephemeral_ttl_ms=5000):
-        super(FIFORedlock, self).__init__(connection_list, retry_count, retry_delay)
+                 fifo_ephemeral_ttl_ms=5000, cluster=False, clock=time.time, sleep=time.sleep,
+                 spawn=spawn_thread):
+        super(FIFORedlock, self).__init__(connection_list, retry_count, retry_delay, cluster, clock, sleep, spawn)
         self.fifo_retry_count = fifo_retry_count
         self.fifo_retry_delay = fifo_retry_delay
         self.fifo_queue_length = fifo_queue_length
@@ -32,12 +33,6 @@ class FIFORedlock(ExtendableRedlock):
     def lock(self, resource, ttl):
         self.logger.info('[{resource}] Locking with ttl {ttl}ms'.format(resource=resource, ttl=ttl))
 
-        def get_resource_name_with_position(resource, position):
-            if position == 0:
-                return resource
-            else:
-                return "{0}__{1}".format(resource, position)
-
         current_position = None
         lock = None
         retries = 0
@@ -51,7 +46,7 @@ class FIFORedlock(ExtendableRedlock):
             if lock is not None:
                 super(FIFORedlock, self).extend(lock, self.fifo_ephemeral_ttl_ms)
             next_lock_ttl = ttl if next_position is 0 else self.fifo_ephemeral_ttl_ms
-            next_lock = super(FIFORedlock, self).lock(get_resource_name_with_position(resource, next_position), next_lock_ttl)
+            next_lock = super(FIFORedlock, self).lock(get_resource_name_with_position(resource, next_position, self.cluster), next_lock_ttl)
 
             if next_lock:
                 retries = 0
@@ -61,7 +56,7 @@ class FIFORedlock(ExtendableRedlock):
                 lock = next_lock
             else:
                 retries += 1
-                sleep(self.fifo_retry_delay)
+                self.sleep(self.fifo_retry_delay)
 
         if current_position == 0:
             self.logger.info('[{resource}] Lock acquired with validity {validity}ms'.format(resource=resource, validity=lock.validity))
@@ -71,3 +66,34 @@ class FIFORedlock(ExtendableRedlock):
             if lock is not None:
                 super(FIFORedlock, self).unlock(lock)
             return False
+
+
+def get_resource_name_with_position(resource, position, hash_tagged=False):
+    if position == 0:
+        return resource
+    elif hash_tagged:
+        return "{0}__{1}".format(hash_tag(resource), position)
+    else:
+        return "{0}__{1}".format(resource, position)
+
+
+def hash_tag(resource):
+    """
+        Wraps the resource in a Redis Cluster hash tag, unless it already carries one, so
+        every position of its queue maps to the same slot as the resource itself.
+
+        A resource without a valid hash tag is hashed whole by Redis; if it contains a '}'
+        no wrapping can reproduce that slot, so it is refused.
+    """
+    tag_start = resource.find('{')
+    tag_end = resource.find('}', tag_start + 1)
+    if tag_start != -1 and tag_end > tag_start + 1:
+        return resource
+    elif '}' in resource:
+        raise ResourceCannotBeHashTagged(resource)
+    else:
+        return "{{{0}}}".format(resource)
+
+
+class ResourceCannotBeHashTagged(Exception):
+    pass
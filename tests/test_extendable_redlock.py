@@ -16,13 +16,15 @@ import threading
 from time import sleep
 import unittest
 import fakeredis
-from hamcrest import assert_that, is_
+import redis
+from hamcrest import assert_that, is_, greater_than_or_equal_to, less_than
 
 from mock import patch
 from redlock import Redlock, Lock
 from redlock_fifo.extendable_redlock import ExtendableRedlock, LockAutoextendAlreadyRunning
 
-from tests.testutils import FakeRedisCustom, get_servers_pool, seconds_to_ms, ms_to_seconds
+from tests.testutils import FakeRedisCustom, get_servers_pool, seconds_to_ms, ms_to_seconds, VirtualClock, \
+    VirtualRedisNetwork
 
 
 class ExtendableRedlockTest(unittest.TestCase):
@@ -39,6 +41,34 @@ class ExtendableRedlockTest(unittest.TestCase):
         with self.assertRaises(Warning):
             Redlock([{"cat": "hog"}])
 
+    def test_cluster_mode_connects_a_cluster_client_per_node_on_first_command(self):
+        with patch('redis.cluster.RedisCluster') as redis_cluster:
+            redlock = self.redlock.__class__([{"host": "node1"}, "redis://node2:6379", {"host": "node3"}], cluster=True)
+            assert_that(redis_cluster.call_count, is_(0))
+
+            for server in redlock.servers:
+                server.get('shorts')
+
+        assert_that(len(redlock.servers), is_(3))
+        assert_that(redlock.quorum, is_(2))
+        redis_cluster.assert_any_call(host="node1")
+        redis_cluster.from_url.assert_called_once_with("redis://node2:6379")
+
+    def test_cluster_mode_reaches_quorum_when_a_node_cannot_be_connected(self):
+        network = VirtualRedisNetwork(VirtualClock())
+
+        def redis_cluster(host, port=6379):
+            if host == 'node2':
+                raise redis.exceptions.RedisClusterException('Redis Cluster cannot be connected')
+            return network(host, port)
+
+        with patch('redis.cluster.RedisCluster', new=redis_cluster):
+            redlock = self.redlock.__class__([{"host": "node1"}, {"host": "node2"}, {"host": "node3"}], cluster=True)
+
+        lock = redlock.lock('shorts', 10000)
+        self.assertIsInstance(lock, Lock)
+        assert_that(redlock.is_valid(lock), is_(True))
+
     def test_should_be_able_to_lock_a_resource_after_it_has_been_unlocked(self):
         lock = self.redlock_with_51_servers_up_49_down.lock("shorts", 10)
         self.assertIsInstance(lock, Lock)
@@ -157,6 +187,54 @@ class ExtendableRedlockTest(unittest.TestCase):
         sleep(ms_to_seconds(lock.validity + 100))
         assert_that(self.redlock_with_51_servers_up_49_down.is_valid(lock), is_(False))
 
+    def test_a_lock_goes_invalid_after_validity_time_in_virtual_time(self):
+        clock = VirtualClock()
+        with patch('redis.StrictRedis', new=VirtualRedisNetwork(clock, latency=0.001)):
+            redlock = self.redlock.__class__(get_servers_pool(active=3, inactive=2), clock=clock.time, sleep=clock.sleep)
+
+        lock = redlock.lock('test_goes_invalid', seconds_to_ms(60))
+        assert_that(lock.validity, is_(seconds_to_ms(60) - 5 - 602))
+
+        clock.sleep(ms_to_seconds(lock.validity))
+        assert_that(redlock.is_valid(lock), is_(True))
+
+        clock.sleep(1)
+        assert_that(redlock.is_valid(lock), is_(False))
+
+    def test_a_lock_survives_a_minority_of_crashed_servers_in_virtual_time(self):
+        clock = VirtualClock()
+        network = VirtualRedisNetwork(clock)
+        with patch('redis.StrictRedis', new=network):
+            redlock = self.redlock.__class__(get_servers_pool(active=3, inactive=0), clock=clock.time, sleep=clock.sleep)
+
+        lock = redlock.lock('test_crash', seconds_to_ms(60))
+        network.crash('server0.active', db='server0.active')
+        assert_that(redlock.is_valid(lock), is_(True))
+        assert_that(redlock.lock('test_crash', seconds_to_ms(60)), is_(False))
+
+        network.crash('server1.active', db='server1.active')
+        assert_that(redlock.is_valid(lock), is_(False))
+
+    def test_a_majority_partition_blocks_locking_until_it_heals_in_virtual_time(self):
+        clock = VirtualClock()
+        network = VirtualRedisNetwork(clock)
+        with patch('redis.StrictRedis', new=network):
+            redlock = self.redlock.__class__(get_servers_pool(active=3, inactive=0), clock=clock.time, sleep=clock.sleep)
+
+        lock = redlock.lock('test_partition', seconds_to_ms(60))
+        network.partition('server0.active', db='server0.active')
+        network.partition('server1.active', db='server1.active')
+
+        assert_that(redlock.is_valid(lock), is_(False))
+        assert_that(redlock.lock('test_partition_other', seconds_to_ms(60)), is_(False))
+
+        network.heal('server0.active', db='server0.active')
+        network.heal('server1.active', db='server1.active')
+
+        assert_that(redlock.is_valid(lock), is_(True))
+        self.assertIsInstance(redlock.lock('test_partition_other', seconds_to_ms(60)), Lock)
+        clock.run()
+
     def test_a_lock_goes_invalid_if_majority_not_attained(self):
         lock = self.redlock_with_51_servers_up_49_down.lock('test_goes_invalid', seconds_to_ms(30))
         assert_that(self.redlock_with_51_servers_up_49_down.is_valid(lock), is_(True))
@@ -203,6 +281,27 @@ class ExtendableRedlockTest(unittest.TestCase):
             sleep(1)
             assert_that(self.redlock_with_51_servers_up_49_down.is_valid(lock), is_(False))
 
+    def test_autoextend_keeps_a_lock_valid_for_a_minute_in_virtual_time(self):
+        clock = VirtualClock()
+        with patch('redis.StrictRedis', new=VirtualRedisNetwork(clock, latency=0.001)):
+            redlock = self.redlock.__class__(get_servers_pool(active=3, inactive=2),
+                                             clock=clock.time, sleep=clock.sleep, spawn=clock.spawn)
+        elapsed = []
+
+        def client():
+            lock = redlock.lock('test_autoextend', 500)
+            start = clock.time()
+            with redlock.autoextend(lock, every_ms=200, new_ttl=500):
+                clock.sleep(60)
+                assert_that(redlock.is_valid(lock), is_(True))
+            elapsed.append(clock.time() - start)
+
+        clock.spawn(client)
+        clock.run()
+
+        assert_that(elapsed[0], greater_than_or_equal_to(60))
+        assert_that(elapsed[0], less_than(60.3))
+
     def test_autoextend_twice_is_an_error(self):
         lock = self.redlock_with_51_servers_up_49_down.lock('test_autoextend', 500)
 
@@ -16,9 +16,10 @@ import threading
 from time import sleep
 import mock
 import redlock
-from redlock_fifo.fifo_redlock import FIFORedlock
+from redlock_fifo.fifo_redlock import FIFORedlock, get_resource_name_with_position, ResourceCannotBeHashTagged
 from tests import test_extendable_redlock
-from tests.testutils import FakeRedisCustom, get_servers_pool, TestTimer, ThreadCollection
+from tests.testutils import FakeRedisCustom, get_servers_pool, TestTimer, ThreadCollection, VirtualClock, \
+    VirtualRedisNetwork
 
 
 class FIFORedlockTest(test_extendable_redlock.ExtendableRedlockTest):
@@ -172,3 +173,135 @@ class FIFORedlockTest(test_extendable_redlock.ExtendableRedlockTest):
         thread_C.join()
         thread_D.join()
 
+    def test_call_order_of_a_hundred_waiters_in_virtual_time(self):
+        clock = VirtualClock()
+        with mock.patch('redis.StrictRedis', new=VirtualRedisNetwork(clock)):
+            connector = FIFORedlock(get_servers_pool(active=3, inactive=2),
+                                    retry_delay=0.01,
+                                    fifo_queue_length=100,
+                                    fifo_retry_count=1000,
+                                    fifo_retry_delay=0.005,
+                                    clock=clock.time,
+                                    sleep=clock.sleep)
+
+        holders = []
+        shared_memory = []
+
+        def client(name):
+            clock.sleep(name * 0.005)
+            lock = connector.lock('test_call_order_virtual_time', ttl=1000)
+            self.assertTrue(lock)
+            holders.append(name)
+            shared_memory.append((name, len(holders)))
+            clock.sleep(0.02)
+            holders.remove(name)
+            connector.unlock(lock)
+
+        for name in range(100):
+            clock.spawn(client, name)
+        clock.run()
+
+        self.assertEqual([(name, 1) for name in range(100)], shared_memory)
+
+    def test_a_thousand_staggered_clients_churning_a_lease_in_virtual_time(self):
+        clock = VirtualClock()
+        with mock.patch('redis.StrictRedis', new=VirtualRedisNetwork(clock, latency=0.001)):
+            connector = FIFORedlock(get_servers_pool(active=3, inactive=2),
+                                    retry_delay=0.01,
+                                    fifo_queue_length=8,
+                                    fifo_retry_count=1000,
+                                    fifo_retry_delay=0.005,
+                                    clock=clock.time,
+                                    sleep=clock.sleep,
+                                    spawn=clock.spawn)
+
+        holders = []
+        waits = []
+
+        def client(name):
+            clock.sleep(name * 0.06)
+            start = clock.time()
+            lock = connector.lock('test_lease_churn_virtual_time', ttl=1000)
+            self.assertTrue(lock)
+            holders.append(name)
+            waits.append((len(holders), clock.time() - start))
+            clock.sleep(0.02)
+            holders.remove(name)
+            connector.unlock(lock)
+
+        for name in range(1000):
+            clock.spawn(client, name)
+        clock.run()
+
+        self.assertEqual(1000, len(waits))
+        self.assertEqual({1}, set(entry[0] for entry in waits))
+        self.assertLess(max(entry[1] for entry in waits), 1)
+
+    def test_a_crashed_lock_holder_is_replaced_after_its_ttl_in_virtual_time(self):
+        clock = VirtualClock()
+        network = VirtualRedisNetwork(clock, latency=0.001)
+        with mock.patch('redis.StrictRedis', new=network):
+            connector = FIFORedlock(get_servers_pool(active=3, inactive=0),
+                                    fifo_retry_count=1000,
+                                    fifo_retry_delay=0.01,
+                                    clock=clock.time,
+                                    sleep=clock.sleep)
+
+        shared_memory = []
+
+        def crashing_client():
+            connector.lock('test_crashed_holder', ttl=1000)
+            shared_memory.append(('A', clock.time()))
+
+        def waiting_client():
+            clock.sleep(0.1)
+            lock = connector.lock('test_crashed_holder', ttl=1000)
+            self.assertTrue(lock)
+            shared_memory.append(('B', clock.time()))
+
+        clock.spawn(crashing_client)
+        clock.spawn(waiting_client)
+        clock.run()
+
+        self.assertEqual(['A', 'B'], [entry[0] for entry in shared_memory])
+        self.assertGreaterEqual(shared_memory[1][1] - shared_memory[0][1], 0.9)
+        self.assertLess(shared_memory[1][1] - shared_memory[0][1], 1.3)
+
+    def test_cluster_mode_queues_on_hash_tagged_keys(self):
+        network = VirtualRedisNetwork(VirtualClock(), record_commands=True)
+        with mock.patch('redis.cluster.RedisCluster', new=network):
+            connector = FIFORedlock([{'host': 'node0'}, {'host': 'node1'}, {'host': 'node2'}],
+                                    fifo_queue_length=3,
+                                    cluster=True)
+
+        lock = connector.lock('pants', 1000)
+        connector.extend(lock, 2000)
+        connector.unlock(lock)
+
+        self.assertEqual('pants', lock.resource)
+        commands = [command[1:] for command in network.commands if command[0] == 'node0']
+        self.assertEqual([('set', '{pants}__3'),
+                          ('eval', '{pants}__3'), ('set', '{pants}__2'), ('eval', '{pants}__3'),
+                          ('eval', '{pants}__2'), ('set', '{pants}__1'), ('eval', '{pants}__2'),
+                          ('eval', '{pants}__1'), ('set', 'pants'), ('eval', '{pants}__1'),
+                          ('eval', 'pants'), ('eval', 'pants')], commands)
+
+    def test_queue_positions_are_not_hash_tagged_by_default(self):
+        self.assertEqual(get_resource_name_with_position('pants', 0), 'pants')
+        self.assertEqual(get_resource_name_with_position('pants', 1), 'pants__1')
+
+    def test_queue_positions_are_hash_tagged_on_the_resource(self):
+        self.assertEqual(get_resource_name_with_position('pants', 0, hash_tagged=True), 'pants')
+        self.assertEqual(get_resource_name_with_position('pants', 1, hash_tagged=True), '{pants}__1')
+        self.assertEqual(get_resource_name_with_position('pants', 64, hash_tagged=True), '{pants}__64')
+        self.assertEqual(get_resource_name_with_position('a{b', 3, hash_tagged=True), '{a{b}__3')
+
+    def test_queue_positions_keep_an_existing_hash_tag(self):
+        self.assertEqual(get_resource_name_with_position('{user1}.pants', 0, hash_tagged=True), '{user1}.pants')
+        self.assertEqual(get_resource_name_with_position('{user1}.pants', 3, hash_tagged=True), '{user1}.pants__3')
+        self.assertEqual(get_resource_name_with_position('a}b{c}', 3, hash_tagged=True), 'a}b{c}__3')
+
+    def test_queue_positions_cannot_be_hash_tagged_with_an_unmatched_closing_brace(self):
+        for resource in ['a}b', '{}x', 'a{}b{c}']:
+            with self.assertRaises(ResourceCannotBeHashTagged):
+                get_resource_name_with_position(resource, 3, hash_tagged=True)
@@ -0,0 +1,62 @@
+# Copyright 2016 Internap
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+from hamcrest import assert_that, is_
+from mock import patch
+from redlock_fifo.extendable_redlock import ExtendableRedlock
+
+from tests.testutils import VirtualClock, VirtualRedisNetwork
+
+
+class VirtualClockTest(unittest.TestCase):
+    def test_run_reraises_the_first_client_exception(self):
+        clock = VirtualClock()
+
+        def client():
+            clock.sleep(1)
+            raise AssertionError('client failed')
+
+        clock.spawn(client)
+        clock.spawn(clock.sleep, 2)
+        with self.assertRaises(AssertionError):
+            clock.run()
+        assert_that(clock.time(), is_(2))
+
+
+class VirtualRedisTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.server = VirtualRedisNetwork(self.clock)(host='localhost')
+
+    def test_keys_match_the_pattern(self):
+        self.server.set('pants', 'A')
+        self.server.set('{pants}__1', 'B')
+        self.server.set('shorts', 'C')
+
+        assert_that(sorted(self.server.keys()), is_(['pants', 'shorts', '{pants}__1']))
+        assert_that(self.server.keys('{pants}__*'), is_(['{pants}__1']))
+
+    def test_an_unsupported_script_fails_the_run_even_if_the_redlock_swallows_it(self):
+        class OtherExtendableRedlock(ExtendableRedlock):
+            extend_script = ExtendableRedlock.extend_script.replace('pexpire', 'expire')
+
+        with patch('redis.StrictRedis', new=self.server.network):
+            redlock = OtherExtendableRedlock([{'host': 'localhost'}], clock=self.clock.time, sleep=self.clock.sleep)
+        lock = redlock.lock('pants', 1000)
+
+        assert_that(redlock.extend(lock, 2000), is_(False))
+        with self.assertRaises(NotImplementedError):
+            self.clock.run()
@@ -13,6 +13,9 @@
 # limitations under the License.
 
 from fakeredis import FakeRedis
+from fnmatch import fnmatchcase
+import heapq
+import itertools
 import redis
 from redlock import Redlock
 from redlock_fifo.extendable_redlock import ExtendableRedlock
@@ -65,6 +68,257 @@ def get_servers_pool(active, inactive):
     return redis_servers
 
 
+class VirtualClock(object):
+    """
+        Deterministic virtual time, to be injected as the clock, sleep and spawn of a redlock.
+
+        Clients started with spawn() run one at a time: a sleeping client keeps running while it is
+        still the first to wake up, otherwise it gives its turn to whoever wakes up first (ties in
+        spawn/sleep order). run() returns once they all finished and re-raises the first failure
+        recorded, be it raised by a client or by a VirtualRedis asked to run an unknown script.
+        The thread that created the clock may also sleep on its own, but any other thread has to be
+        started with spawn().
+
+        Every hand-off between clients is an OS thread switch, and waiters on a FIFORedlock poll:
+        a queue of N waiters queued at once costs roughly N^2 polls. A hundred such waiters take
+        about a second, two hundred about four and a thousand over a minute. Only staggered clients,
+        that rarely queue behind each other, scale to the thousands within seconds.
+    """
+    def __init__(self, start=0.0):
+        self.now = start
+        self._lock = threading.Lock()
+        self._sleepers = []
+        self._sequence = itertools.count()
+        self._threads = []
+        self._local = threading.local()
+        self._running = None
+        self._exception = None
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        turn = self._turn()
+        with self._lock:
+            if self._running not in (turn, None):
+                raise RuntimeError("sleep() called from a thread that was not started with spawn()")
+
+            wake_up_time = self.now + seconds
+            if not self._sleepers or wake_up_time < self._sleepers[0][0]:
+                self.now = wake_up_time
+                self._running = turn
+                return
+
+            self._wake_up_at(wake_up_time, turn)
+            self._pass_turn()
+        turn.acquire()
+
+    def spawn(self, target, *args):
+        thread = VirtualThread(self, target, args)
+        with self._lock:
+            self._wake_up_at(self.now, thread.turn)
+        self._threads.append(thread)
+        thread.start()
+        return thread
+
+    def run(self):
+        with self._lock:
+            if self._running in (getattr(self._local, 'turn', None), None):
+                self._pass_turn()
+        while self._threads:
+            self._threads.pop(0).join()
+        if self._exception is not None:
+            raise self._exception
+
+    def record_failure(self, exception):
+        if self._exception is None:
+            self._exception = exception
+
+    def _turn(self):
+        if getattr(self._local, 'turn', None) is None:
+            self._local.turn = new_turn()
+        return self._local.turn
+
+    def _wake_up_at(self, wake_up_time, turn):
+        heapq.heappush(self._sleepers, (wake_up_time, next(self._sequence), turn))
+
+    def _pass_turn(self):
+        if self._sleepers:
+            wake_up_time, _, self._running = heapq.heappop(self._sleepers)
+            self.now = max(self.now, wake_up_time)
+            self._running.release()
+        else:
+            self._running = None
+
+
+def new_turn():
+    """
+        A turn is a lock that stays held while its thread is not allowed to run:
+        releasing it lets the thread run, the thread takes it back when it waits again.
+    """
+    turn = threading.Lock()
+    turn.acquire()
+    return turn
+
+
+class VirtualThread(threading.Thread):
+    def __init__(self, clock, client, client_args):
+        super(VirtualThread, self).__init__()
+        self.daemon = True
+        self.clock = clock
+        self.client = client
+        self.client_args = client_args
+        self.turn = new_turn()
+        self.joiners = []
+        self.finished = False
+
+    def run(self):
+        self.turn.acquire()
+        self.clock._local.turn = self.turn
+        try:
+            self.client(*self.client_args)
+        except BaseException as e:
+            self.clock.record_failure(e)
+        finally:
+            with self.clock._lock:
+                self.finished = True
+                for joiner in self.joiners:
+                    self.clock._wake_up_at(self.clock.now, joiner)
+                self.clock._pass_turn()
+
+    def join(self, timeout=None):
+        turn = getattr(self.clock._local, 'turn', None)
+        with self.clock._lock:
+            waiting = not self.finished and turn is not None and self.clock._running is turn
+            if waiting:
+                self.joiners.append(turn)
+                self.clock._pass_turn()
+        if waiting:
+            turn.acquire()
+        super(VirtualThread, self).join(timeout)
+
+
+class VirtualRedisNetwork(object):
+    """
+        In-memory redis servers living in a VirtualClock, keyed by host.
+        Patch it in place of redis.StrictRedis so a redlock connects to it.
+
+        Every command takes `latency` seconds of virtual time, keys expire in virtual time and
+        servers can be brought down (partition) or crashed (down and emptied) at will.
+        Hosts ending with '.inactive' start down, as with FakeRedisCustom.
+        With record_commands, every command is logged in `commands` as (host, command, *keys).
+    """
+    def __init__(self, clock, latency=0, record_commands=False):
+        self.clock = clock
+        self.latency = latency
+        self.databases = {}
+        self.down = set()
+        self.commands = [] if record_commands else None
+
+    def __call__(self, host='localhost', port=6379, db=0, **kwargs):
+        server = (host, port, db)
+        if server not in self.databases:
+            self.databases[server] = {}
+            if str(host).endswith('.inactive'):
+                self.down.add(server)
+        return VirtualRedis(self, server)
+
+    def partition(self, host, port=6379, db=0):
+        self.down.add((host, port, db))
+
+    def heal(self, host, port=6379, db=0):
+        self.down.discard((host, port, db))
+
+    def crash(self, host, port=6379, db=0):
+        self.partition(host, port, db)
+        self.databases[(host, port, db)].clear()
+
+
+class VirtualRedis(object):
+    def __init__(self, network, server):
+        self.network = network
+        self.server = server
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        data = self._communicate('set', name)
+        exists = self._exists(data, name)
+        if (nx and exists) or (xx and not exists):
+            return None
+        ttl = px if px is not None else ex * 1000 if ex is not None else None
+        data[name] = (value, self._expiry(ttl))
+        return True
+
+    def get(self, name):
+        data = self._communicate('get', name)
+        return data[name][0] if self._exists(data, name) else None
+
+    def delete(self, *names):
+        data = self._communicate('delete', *names)
+        return len([data.pop(name) for name in names if self._exists(data, name)])
+
+    def pexpire(self, name, new_expiry_ms):
+        data = self._communicate('pexpire', name)
+        if not self._exists(data, name):
+            return False
+        data[name] = (data[name][0], self._expiry(new_expiry_ms))
+        return True
+
+    def pttl(self, name):
+        data = self._communicate('pttl', name)
+        if not self._exists(data, name):
+            return -2
+        expires_at = data[name][1]
+        return -1 if expires_at is None else int((expires_at - self.network.clock.time()) * 1000)
+
+    def keys(self, pattern='*'):
+        data = self._communicate('keys')
+        return [name for name in list(data) if self._exists(data, name) and fnmatchcase(name, pattern)]
+
+    def flushall(self):
+        self._communicate('flushall').clear()
+
+    def eval(self, script, nb_of_args, *args):
+        data = self._communicate('eval', *args[:nb_of_args])
+        current_value = data[args[0]][0] if self._exists(data, args[0]) else None
+
+        if script == Redlock.unlock_script:
+            if current_value != args[1]:
+                return 0
+            del data[args[0]]
+            return 1
+        elif script == ExtendableRedlock.extend_script:
+            if current_value != args[1]:
+                return 0
+            data[args[0]] = (current_value, self._expiry(int(args[2])))
+            return 1
+
+        # redlocks swallow every error of an instance: record it so the script mismatch fails the test
+        unsupported_script = NotImplementedError("VirtualRedis does not support script: {0}".format(script))
+        self.network.clock.record_failure(unsupported_script)
+        raise unsupported_script
+
+    def _communicate(self, command, *keys):
+        if self.network.commands is not None:
+            self.network.commands.append((self.server[0], command) + keys)
+        if self.network.latency:
+            self.network.clock.sleep(self.network.latency)
+        if self.server in self.network.down:
+            raise redis.exceptions.ConnectionError
+        return self.network.databases[self.server]
+
+    def _exists(self, data, name):
+        if name not in data:
+            return False
+        expires_at = data[name][1]
+        if expires_at is not None and expires_at <= self.network.clock.time():
+            del data[name]
+            return False
+        return True
+
+    def _expiry(self, ttl_ms):
+        return None if ttl_ms is None else self.network.clock.time() + ms_to_seconds(ttl_ms)
+
+
 class ThreadCollection(object):
     def __init__(self):
         self.threads = []